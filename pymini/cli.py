@@ -1,8 +1,25 @@
 import glob
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from pymini.pymini import minify
 from argparse import ArgumentParser
 
+
+_STAR_IMPORT = re.compile(r'^\s*from\s+\S*?(\w+)\s+import\s+\*', re.MULTILINE)
+
+
+def read(path):
+    with open(path, 'rb') as f:  # skip TextIOWrapper, decode in one call
+        return f.read().decode('utf-8')
+
+
+def write(path, source):
+    with open(path, 'wb') as f:
+        f.write(source.encode('utf-8'))
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument('path', help='Path to the file or directory to minify')
@@ -10,26 +27,46 @@ def main():
     parser.add_argument('--keep-global-variables', action='store_true', help='Keep global variables as they are. Useful for compressing libraries')
     parser.add_argument('--single-file', action='store_true', help='Concatenate all outputs into a single file')
     parser.add_argument('-o', '--output', help='Path to the output directory', default='./')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes to minify files with. Requires --keep-module-names and --keep-global-variables, so that files can be minified independently')
     args = parser.parse_args()
-
-    sources, modules = [], []
-    for path in glob.iglob(args.path):
-        if not path.endswith('.py') or '.ugli.' in path:
-            continue
-        with open(path) as f:
-            sources.append(f.read())
-        modules.append(Path(path).stem)
-    cleaned, modules = minify(
-        sources, modules, keep_module_names=args.keep_module_names,
+    independent = args.keep_module_names and args.keep_global_variables and not args.single_file
+    if args.jobs > 1 and not independent:
+        parser.error('--jobs requires --keep-module-names and --keep-global-variables, without --single-file')
+    options = dict(
+        keep_module_names=args.keep_module_names,
         keep_global_variables=args.keep_global_variables,
-        output_single_file=args.single_file
+        output_single_file=args.single_file,
     )
-    output = Path(args.output)
-    output.mkdir(parents=True, exist_ok=True)
-    for source, module in zip(cleaned, modules):
-        with open(output / f'{module}.py', 'w') as f:
-            f.write(source)
+
+    paths = [
+        path for path in glob.iglob(args.path)
+        if path.endswith('.py') and '.ugli.' not in path
+    ]
+    modules = [Path(path).stem for path in paths]
+
+    # overlap file reads and writes, since each blocks on disk
+    with ThreadPoolExecutor(max_workers=min(32, len(paths) or 1)) as executor:
+        sources = list(executor.map(read, paths))
+        if independent and not set(modules).isdisjoint(
+            module for source in sources for module in _STAR_IMPORT.findall(source)
+        ):  # a star import shares module-level names, so files need one generator
+            if args.jobs > 1:
+                parser.error('--jobs can\'t be used when a file star-imports another')
+            independent = False
+        if independent:  # minify each file separately, so output doesn't depend on --jobs
+            minify_one = partial(minify, siblings=modules, **options)
+            if args.jobs > 1:
+                with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                    results = list(pool.map(minify_one, sources, modules))
+            else:
+                results = map(minify_one, sources, modules)
+            cleaned = [source for (source,), _ in results]
+        else:
+            cleaned, modules = minify(sources, modules, **options)
+        output = Path(args.output)
+        output.mkdir(parents=True, exist_ok=True)
+        list(executor.map(write, [output / f'{module}.py' for module in modules], cleaned))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
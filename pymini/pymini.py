@@ -1,10 +1,38 @@
 import ast
+import bisect
+import itertools
 import keyword
+import re
+import tokenize
+from collections import Counter
+from io import StringIO
 from typing import Dict, List, Set
 from .utils import variable_name_generator
 
 
+_INDENT = re.compile(r'\s*')
+_KEYWORDS = frozenset(keyword.kwlist)
+_LOAD, _STORE = ast.Load(), ast.Store()  # contexts hold no state, so share them
+_STATEMENT_FIELDS = frozenset(('body', 'orelse', 'finalbody', 'handlers', 'cases'))
+_SEPARATORS = frozenset(':;=')  # no space needed on either side
+_SPACELESS_ENDS = _SEPARATORS | {' '}  # no space needed before a keyword
+_MATCH_VALUE = getattr(ast, 'MatchValue', ())  # match patterns are new in 3.10
+_MATCH_MAPPING = getattr(ast, 'MatchMapping', ())
+
+
 class Transformer:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._visitors = {}  # node type -> visitor, resolved once per class
+
+    def visit(self, node):
+        try:
+            visitor = self._visitors[type(node)]
+        except KeyError:
+            visitor = self._visitors[type(node)] = getattr(
+                type(self), 'visit_' + type(node).__name__, type(self).generic_visit)
+        return visitor(self, node)
+
     def transform(self, *trees):
         for tree in trees:
             self.visit(tree)
@@ -40,13 +68,21 @@ class ReturnSimplifier(NodeTransformer):
     
         return (some code)
 
-    NOTE: unused_names must be modified in-place, since the set is passed to
-    RemoveUnusedVariables at initialization. Can't return a new set.
+    NOTE: unused_assigns must be modified in-place, since the set is passed to
+    CommentRemover at initialization. Can't return a new set.
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.name_to_node = {}
-        self.unused_names = set()
+        self.unused_assigns = set()  # assignments inlined into a return
+
+    def generic_visit(self, node):
+        """Only visit statements, as expressions hold no assignments or returns."""
+        for field in node._fields:
+            body = getattr(node, field, None)
+            if field in _STATEMENT_FIELDS and isinstance(body, list):
+                body[:] = [self.visit(statement) for statement in body]
+        return node
 
     def visit_Assign(self, node: ast.Assign) -> ast.Assign:
         if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
@@ -54,40 +90,18 @@ class ReturnSimplifier(NodeTransformer):
         return self.generic_visit(node)
 
     def visit_Return(self, node: ast.Return) -> ast.Return:
-        if isinstance(node.value, ast.Name):
-            self.unused_names.add(node.value.id)
+        if isinstance(node.value, ast.Name) and node.value.id in self.name_to_node:
             node = self.name_to_node[node.value.id]
+            self.unused_assigns.add(node)
             return ast.Return(value=node.value)
         return self.generic_visit(node)
 
 
-class RemoveUnusedVariables(NodeTransformer):
-    """Remove all unused variables.
-    
-    NOTE: cannot store a copy of unused_names, as this set is modified in-place
-    after initialization.
-    """
-    def __init__(self, unused_names: Set[str]):
-        super().__init__()
-        self.unused_names = unused_names
-
-    def visit_Assign(self, node: ast.Name) -> ast.Name:
-        if isinstance(node.targets[0], ast.Name) and node.targets[0].id in self.unused_names:
-            return None
-        return self.generic_visit(node)
-
-
-class VariableNameCollector(NodeVisitor):
-    """Collects all variable names in scope."""
-    def __init__(self):
-        self.names = set()
-
-    def visit_Name(self, node):
-        self.names.add(node.id)
-
-
 class ParentSetter(NodeTransformer):
     """Adds parent attribute to each node.
+
+    Also collects all variable names along the way, so that the shorteners
+    can avoid them without another walk over the tree.
     
     >>> def apply(src):
     ...     tree = ast.parse(src)
@@ -99,20 +113,41 @@ class ParentSetter(NodeTransformer):
     True
     >>> isinstance(tree.body[0].value.parent, ast.Assign)
     True
+    >>> setter = ParentSetter()
+    >>> _ = setter.visit(ast.parse("lorem = ipsum(dolor)"))
+    >>> sorted(setter.names)
+    ['dolor', 'ipsum', 'lorem']
     """
+    def __init__(self):
+        self.names = set()
+
     def visit(self, node):
-        for child in ast.iter_child_nodes(node):
-            child.parent = node
-            self.visit(child)
-        return super().visit(node)
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            for child in self.iter_child_nodes(parent):
+                child.parent = parent
+                if isinstance(child, ast.Name):
+                    self.names.add(child.id)
+                stack.append(child)
+        return node
+
+    def iter_child_nodes(self, node):
+        return ast.iter_child_nodes(node)
 
 
-class CommentRemover(NodeTransformer):
+class CommentRemover(ParentSetter):
     """Drop all comments, both single-line and docstrings.
+
+    Also drops assignments that ReturnSimplifier inlined into a return.
+    Bodies left empty are filled with 0. Statements are dropped during the
+    same walk that sets parents and collects names, see ParentSetter.
+
+    NOTE: cannot store a copy of unused_assigns, as this set is modified
+    in-place after initialization.
     
     >>> def apply(code):
     ...     tree = ast.parse(code)
-    ...     tree = ParentSetter().visit(tree)
     ...     tree = CommentRemover().visit(tree)
     ...     return ast.unparse(tree)
     ...
@@ -131,13 +166,36 @@ class CommentRemover(NodeTransformer):
     ... '''))
     def square(x):
         0
+    >>> print(apply('''
+    ... def square(x):
+    ...     \\'\\'\\'Return the square of x.\\'\\'\\'
+    ...     \\'\\'\\'Really.\\'\\'\\'
+    ... '''))
+    def square(x):
+        0
+    >>> tree = ast.parse('lorem = 1\\nipsum = lorem = 2\\nlorem = 3')
+    >>> print(ast.unparse(CommentRemover({tree.body[0]}).visit(tree)))
+    ipsum = lorem = 2
+    lorem = 3
     """
-    def visit_Expr(self, node):
-        if isinstance(node.value, ast.Constant):
-            if len(node.parent.body) == 1:  # if body is just the comment
-                return ast.parse('0').body[0]  # replace comment with 0
-            return None  # otherwise, remove comment
-        return node
+    def __init__(self, unused_assigns: Set[ast.Assign] = frozenset()):
+        super().__init__()
+        self.unused_assigns = unused_assigns
+
+    def is_removable(self, statement):
+        """Check if a statement is a comment or an unused assignment."""
+        if isinstance(statement, ast.Expr):
+            return isinstance(statement.value, ast.Constant)
+        return statement in self.unused_assigns
+
+    def iter_child_nodes(self, node):
+        for field in ('body', 'orelse', 'finalbody'):
+            body = getattr(node, field, None)
+            if isinstance(body, list) and body:
+                body[:] = [statement for statement in body if not self.is_removable(statement)]
+                if not body and field != 'orelse':  # if body was just removed statements, replace them with 0
+                    body.append(ast.Expr(value=ast.Constant(value=0)))
+        return ast.iter_child_nodes(node)
 
 
 class VariableShortener(NodeTransformer):
@@ -151,20 +209,35 @@ class VariableShortener(NodeTransformer):
     """
     def __init__(self, generator, mapping=None, modules=(), keep_global_variables=False):
         self.mapping = mapping or {}
+        self.renamed = Counter(self.mapping.values())  # mapping.values(), for fast lookups
         self.generator = generator
         self.name_to_node = {}
         self.nodes_to_insert = []
         # TODO: cleanup
-        self.str_name_to_node = {}
+        self.str_counts = Counter()
         self.str_mapping = {}
-        self.modules = modules # dont alias variables imported from these modules
+        self.modules = frozenset(modules) # dont alias variables imported from these modules
         self.keep_global_variables = keep_global_variables
 
     def _is_node_global(self, node):
         """Check if a node is global."""
-        return (
-            not hasattr(node, 'parent') or isinstance(node.parent, ast.Module)
-        )
+        parent = getattr(node, 'parent', None)  # one lookup instead of hasattr and a read
+        return parent is None or isinstance(parent, ast.Module)
+
+    def _map(self, name, new_name):
+        """Map name to new_name, keeping renamed in sync with the mapping."""
+        old_name = self.mapping.get(name)
+        if old_name is not None:  # a remapped name is no longer a new name
+            self.renamed[old_name] -= 1
+            if not self.renamed[old_name]:
+                del self.renamed[old_name]
+        self.mapping[name] = new_name
+        self.renamed[new_name] += 1
+        return new_name
+
+    def _shorten(self, name):
+        """Map name to a new, short name and return the new name."""
+        return self._map(name, next(self.generator))
 
     def _visit_ImportOrImportFrom(self, node):
         """Shorten imported library names.
@@ -193,7 +266,7 @@ class VariableShortener(NodeTransformer):
                 if isinstance(node, ast.ImportFrom) or alias.name not in self.modules:
                     old = alias.asname or alias.name
                     if len(old) > 1:
-                        self.mapping[old] = alias.asname = next(self.generator)
+                        alias.asname = self._shorten(old)
         return self.generic_visit(node)
 
     visit_Import = _visit_ImportOrImportFrom
@@ -210,10 +283,10 @@ class VariableShortener(NodeTransformer):
         >>> apply('class Demiurgic: pass\\nholy = Demiurgic()')
         'class Demiurgic:\\n    pass\\nholy = Demiurgic()'
         """
-        if node.name not in self.mapping.values() and not (  # TODO: make .values() more efficient 
+        if node.name not in self.renamed and not (
             self.keep_global_variables and self._is_node_global(node)
         ):  # TODO: rename but insert var def if worth it
-            self.mapping[node.name] = node.name = next(self.generator)
+            node.name = self._shorten(node.name)
         return self.generic_visit(node)
 
     def visit_FunctionDef(self, node):
@@ -226,14 +299,22 @@ class VariableShortener(NodeTransformer):
         >>> shortener = VariableShortener(variable_name_generator(), keep_global_variables=True)
         >>> apply('def demiurgic(palpitation): return palpitation\\nholy = demiurgic()')
         'def demiurgic(a):\\n    return a\\nholy = demiurgic()'
+
+        Keyword-only arguments keep their names, since callers pass them by
+        name.
+
+        >>> shortener = VariableShortener(variable_name_generator())
+        >>> apply('def demiurgic(lorem, /, *ipsum, dolor): return lorem, dolor')
+        'def c(a, /, *b, dolor):\\n    return (a, dolor)'
         """
-        for arg in node.args.args + [node.args.vararg, node.args.kwarg]:
-            if arg is not None and arg.arg not in self.mapping.values():  # TODO: make .values() more efficient
-                self.mapping[arg.arg] = arg.arg = next(self.generator)
+        args = node.args
+        for arg in itertools.chain(args.posonlyargs, args.args, (args.vararg, args.kwarg)):
+            if arg is not None and arg.arg not in self.renamed:
+                arg.arg = self._shorten(arg.arg)
         if self.keep_global_variables and self._is_node_global(node):  # TODO: rename but insert var def if worth it
             return self.generic_visit(node)
-        if node.name not in self.mapping.values():  # TODO: need to dedup this logic
-            self.mapping[node.name] = node.name = next(self.generator)
+        if node.name not in self.renamed:  # TODO: need to dedup this logic
+            node.name = self._shorten(node.name)
         return self.generic_visit(node)
 
     visit_AsyncFunctionDef = visit_FunctionDef
@@ -252,18 +333,25 @@ class VariableShortener(NodeTransformer):
         if self.keep_global_variables and self._is_node_global(node):  # TODO: rename but insert var def if worth it
             return self.generic_visit(node)
         for target in node.targets:
-            if isinstance(target, ast.Name) and target.id not in self.mapping.values():  # TODO: make .values() more efficient
-                self.mapping[target.id] = target.id = next(self.generator)
+            if isinstance(target, ast.Name) and target.id not in self.renamed:
+                target.id = self._shorten(target.id)
         return self.generic_visit(node)
 
     def visit_Call(self, node):
-        """Apply renamed function names."""
+        """Apply renamed method names.
+
+        Plain function names are renamed by visit_Name, when generic_visit
+        reaches node.func.
+
+        >>> shortener = VariableShortener(variable_name_generator())
+        >>> apply = lambda src: ast.unparse(shortener.visit(ast.parse(src)))
+        >>> apply('def demiurgic(): pass\\ndemiurgic()()')
+        'def a():\\n    pass\\na()()'
+        """
         if isinstance(node.func, ast.Attribute):
-            if node.func.attr in self.mapping:
-                node.func.attr = self.mapping[node.func.attr]
-        else:
-            if node.func.id in self.mapping:
-                node.func.id = self.mapping[node.func.id]
+            new_attr = self.mapping.get(node.func.attr)
+            if new_attr is not None:
+                node.func.attr = new_attr
         return self.generic_visit(node)
 
     def visit_Name(self, node):
@@ -286,75 +374,105 @@ class VariableShortener(NodeTransformer):
         >>> apply('print(demiurgic)')  # saw 'print' 2x but didn't replace
         'print(demiurgic)'
         """
-        if node.id in self.mapping.values():  # TODO: make .values() more efficient
+        if node.id in self.renamed:
             return node
-        if node.id in self.mapping:
-            node.id = self.mapping[node.id]
+        new_id = self.mapping.get(node.id)
+        if new_id is not None:
+            node.id = new_id
         elif self.keep_global_variables and self._is_node_global(node):  # TODO: rename but insert var def if worth it  # TODO: this optimization should only apply to var def
             return self.generic_visit(node)
         elif node.id in self.name_to_node:
-            self.mapping[node.id] = new_variable_name = next(self.generator)
-            self.nodes_to_insert.append(ast.parse(f'{new_variable_name} = {node.id}').body[0])
+            new_variable_name = self._shorten(node.id)
+            self.nodes_to_insert.append(define_variable(new_variable_name, ast.Name(id=node.id, ctx=_LOAD)))
             self.name_to_node.pop(node.id).id = node.id = new_variable_name
         elif len(node.id) > 1:  # if original variable name more than 1 char
             self.name_to_node[node.id] = node
         return self.generic_visit(node)
 
+    def visit_Module(self, node):
+        """Count string literals, so repeated ones are shortened on first sight.
+
+        Literals in f-strings and match patterns can't be replaced by a name,
+        so they aren't counted.
+        """
+        self.str_counts = Counter()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Constant) and isinstance(child.value, str):
+                self.str_counts[child.value] += 1
+            elif isinstance(child, ast.JoinedStr):
+                self.str_counts.subtract(
+                    value.value for value in child.values if isinstance(value, ast.Constant))
+            elif isinstance(child, _MATCH_VALUE) and isinstance(child.value, ast.Constant):
+                self.str_counts.subtract([child.value.value])
+            elif isinstance(child, _MATCH_MAPPING):
+                self.str_counts.subtract(
+                    key.value for key in child.keys if isinstance(key, ast.Constant))
+        return self.generic_visit(node)
+
+    def visit_JoinedStr(self, node):
+        """Shorten names in f-strings, but leave their literal parts alone.
+
+        >>> shortener = VariableShortener(variable_name_generator())
+        >>> apply = lambda src: ast.unparse(shortener.visit(ast.parse(src)))
+        >>> apply("lorem = 'demiurgic'\\nipsum = f'demiurgic{lorem}'")
+        "a = 'demiurgic'\\nb = f'demiurgic{a}'"
+        """
+        for value in node.values:
+            if isinstance(value, ast.FormattedValue):
+                self.generic_visit(value)
+        return node
+
+    def visit_MatchValue(self, node):
+        if isinstance(node.value, ast.Constant):
+            return node  # a name here would be a capture pattern instead
+        return self.generic_visit(node)
+
+    def visit_MatchMapping(self, node):
+        """Shorten names in mapping patterns, but leave literal keys alone."""
+        node.keys = [
+            key if isinstance(key, ast.Constant) else self.visit(key) for key in node.keys
+        ]  # only literals and attribute lookups are allowed as keys
+        node.patterns = [self.visit(pattern) for pattern in node.patterns]
+        return node
+
     def visit_Constant(self, node):
         """Shorten string literals that are repeated.
         
         >>> shortener = VariableShortener(variable_name_generator())
-        >>> def apply(src):
-        ...     tree = ast.parse(src)
-        ...     ParentSetter().visit(tree)
-        ...     shortener.visit(tree)
-        ...     return ast.unparse(tree)
-        ...
+        >>> apply = lambda src: ast.unparse(shortener.visit(ast.parse(src)))
         >>> apply("lorem = 'demiurgic'\\nipsum = 'demiurgic'")
-        'a = c\\nb = c'
+        'a = b\\nc = b'
         >>> apply("dolor = 'demiurgic'")
-        'd = c'
+        'd = b'
         >>> apply("cached['demiurgic'] = 'palpitation'")
-        "cached[c] = 'palpitation'"
+        "cached[b] = 'palpitation'"
         >>> apply("demiurgic = 'demiurgic'")
-        'e = c'
+        'e = b'
         >>> print(apply("if 'demiurgic' in lorem: print(lorem)"))
-        if c in a:
+        if b in a:
             print(a)
+        >>> apply("echo('palpitation', 'palpitation')")
+        'echo(f, f)'
         """
         if not isinstance(node.s, str):  # TODO: generic for all constants?
             return node
         # TODO: this is a copy of visit_Name, basically
-        if node.s in self.str_mapping.values():  # TODO: make more efficient
-            return node
-        if node.s in self.str_mapping:
-            node = ast.parse(self.str_mapping[node.s]).body[0].value
-        elif node.s in self.str_name_to_node:
-            old_s = node.s
+        if node.s not in self.str_mapping:
+            if self.str_counts[node.s] < 2:
+                return node
             self.str_mapping[node.s] = new_variable_name = next(self.generator)
-            self.nodes_to_insert.append(ast.parse(f"{new_variable_name} = '{node.s}'").body[0])
-            old_node = self.str_name_to_node[node.s]
-            # TODO: instead of writing all these cases, replace in a second pass?
-            if hasattr(old_node, 'parent'):
-                if isinstance(old_node.parent, ast.Assign):
-                    old_node.parent.value = ast.parse(self.str_mapping[node.s]).body[0].value
-                if isinstance(old_node.parent, ast.Subscript):
-                    old_node.parent.slice = ast.parse(self.str_mapping[node.s]).body[0].value
-            node = ast.parse(self.str_mapping[node.s]).body[0].value
-            del self.str_name_to_node[old_s]
-        else:
-            self.str_name_to_node[node.s] = node
-        return node
+            self.nodes_to_insert.append(define_variable(new_variable_name, ast.Constant(value=node.s)))
+        return ast.copy_location(ast.Name(id=self.str_mapping[node.s], ctx=_LOAD), node)
 
 
 class IndependentVariableShorteners(Transformer):
-    def __init__(self, names, modules, keep_global_variables=False):
+    def __init__(self, names, modules, keep_global_variables=False, siblings=()):
         super().__init__()
         self.generator = variable_name_generator(names)
         self.module_to_shortener = {
             module: VariableShortener(
                 self.generator,
-                modules=modules,
+                modules=siblings or modules,
                 keep_global_variables=keep_global_variables
             ) for module in modules
         }
@@ -408,6 +526,7 @@ class FusedVariableShortener(Transformer):
                     # *again. TODO: figure out why single-char variables are
                     # being renamed
                     fused_mapping.update({v: v for v in shortener.mapping.values()})
+                    fused_mapping.update({v: v for v in shortener.str_mapping.values()})
 
             imported = ImportedVariableShortener(
                 self.generator,
@@ -416,6 +535,7 @@ class FusedVariableShortener(Transformer):
                 module_to_shortener={_module: value for _module, value in self.module_to_shortener.items() if module != _module},
             )
             new_trees.extend(imported.transform(tree))
+            define_custom_variables(tree, imported.nodes_to_insert)
         return new_trees
 
 
@@ -442,11 +562,20 @@ class ImportedVariableShortener(VariableShortener):
         if shortener is not None:
             for alias in node.names:
                 if alias.name in shortener.mapping:
-                    self.mapping[alias.name] = alias.name = shortener.mapping[alias.name]
+                    alias.name = self._map(alias.name, shortener.mapping[alias.name])
             if node.module in self.module_to_module:  # TODO: handle nested modules
                 node.module = self.module_to_module[node.module]
         return self.generic_visit(node)
 
+    def visit_Constant(self, node):
+        """Leave string literals alone, as each module already shortened its own.
+
+        >>> fused = ImportedVariableShortener(variable_name_generator())
+        >>> ast.unparse(fused.visit(ast.parse("lorem = 'demiurgic'\\nipsum = 'demiurgic'")))
+        "a = 'demiurgic'\\nb = 'demiurgic'"
+        """
+        return node
+
 
 class Fuser(Transformer):
     def __init__(self, modules):
@@ -470,18 +599,63 @@ class FileFuser(Fuser):
         return [trees[0]]
 
 
+def define_variable(name, value):
+    """Build the statement `name = value`, without invoking the parser.
+
+    Locations are left for define_custom_variables to fill in.
+
+    >>> node = define_variable('a', ast.Name(id='demiurgic', ctx=_LOAD))
+    >>> ast.unparse(ast.fix_missing_locations(node))
+    'a = demiurgic'
+    """
+    return ast.Assign(targets=[ast.Name(id=name, ctx=_STORE)], value=value)
+
+
 def define_custom_variables(tree, mapping):
-    root = next(ast.walk(tree))
-    for node in mapping:
-        root.body.insert(0, ast.copy_location(node, root))
-    ast.fix_missing_locations(tree)
+    tree.body[:0] = [  # newest definition first
+        ast.fix_missing_locations(ast.copy_location(node, tree)) for node in reversed(mapping)
+    ]
+
+
+_Unparser = getattr(ast, '_Unparser', None)  # private, so it may move or go
+
+
+class CompactUnparser(_Unparser or object):
+    """Unparse using 1-space indentation and no blank lines.
+
+    Emitting compact source directly saves WhitespaceRemover from stripping
+    ast.unparse's 4-space indents and blank lines afterwards. Only usable
+    when ast._Unparser exists.
+
+    >>> print(CompactUnparser().visit(ast.parse('''
+    ... import os
+    ... def square(x):
+    ...     if x:
+    ...         return x ** 2
+    ... ''')))
+    import os
+    def square(x):
+     if x:
+      return x ** 2
+    """
+
+    def maybe_newline(self):
+        pass  # only called directly to separate definitions with blank lines
+
+    def fill(self, text=''):
+        if self._source:
+            self.write('\n')
+        self.write(' ' * self._indent + text)
 
 
 class Unparser:
 
     def transform(self, *trees):
         for tree in trees:
-            yield ast.unparse(tree)
+            if _Unparser is None:  # WhitespaceRemover strips indents and blank lines instead
+                yield ast.unparse(tree)
+            else:
+                yield CompactUnparser().visit(tree)
 
 
 class WhitespaceRemover(NodeTransformer):
@@ -515,13 +689,7 @@ class WhitespaceRemover(NodeTransformer):
             yield self.visit(source)
 
     def visit(self, source: str):
-        # remove blank lines
-        source = '\n'.join(filter(bool, source.splitlines()))
-
-        # remove trailing whitespace
-        source = '\n'.join(line.rstrip() for line in source.splitlines())
-
-        # segment file by indentation
+        # segment file by indentation, dropping blank lines and trailing whitespace
         segments = self.segments_from_source(source)
 
         # reduce indentation to one space
@@ -534,10 +702,7 @@ class WhitespaceRemover(NodeTransformer):
         segments = self.merge_one_liners(segments)
 
         # regenerate source, where indents use only 1 space
-        source = '\n'.join(
-            '\n'.join([' ' * segment['indents'] + line for line in segment['lines']])
-            for segment in segments
-        )
+        source = self.source_from_segments(segments)
 
         # remove extraneous whitespace
         source = self.remove_extraneous_whitespace(source)
@@ -547,26 +712,27 @@ class WhitespaceRemover(NodeTransformer):
     def segments_from_source(self, source: str) -> List[Dict]:
         """Segment provided source code by indentation level.
 
+        Blank lines are dropped and trailing whitespace is removed in the same
+        pass.
+
         >>> WhitespaceRemover().segments_from_source('''
-        ... def square(x):
+        ... def square(x):   
+        ...
         ...     return x ** 2
         ... ''')
-        [{'indents': 0, 'lines': ['', 'def square(x):']}, {'indents': 4, 'lines': ['return x ** 2']}]
+        [{'indents': 0, 'lines': ['def square(x):']}, {'indents': 4, 'lines': ['return x ** 2']}]
         """
         segments = []
-        segment = None
+        lines = None
         for line in source.splitlines():
-            indents = len(line) - len(line.lstrip())
-            line = line.lstrip()
-            if segment is None:
-                segment = {'indents': indents, 'lines': [line]}
-            elif indents != segment['indents']:
-                segments.append(segment)
-                segment = {'indents': indents, 'lines': [line]}
-            else:
-                segment['lines'].append(line)
-        if segment:
-            segments.append(segment)
+            line = line.rstrip()
+            if not line:
+                continue
+            indents = _INDENT.match(line).end()  # measure and strip in one scan
+            if lines is None or indents != segments[-1]['indents']:
+                lines = []
+                segments.append({'indents': indents, 'lines': lines})
+            lines.append(line[indents:])
         return segments
 
     def reduce_indentation(self, segments: List) -> List:
@@ -593,23 +759,25 @@ class WhitespaceRemover(NodeTransformer):
          if x == 6:
           print(x)
         """
-        def update_valley(valley, indents):
-            new_to_old = list(sorted(indents))
+        def update_valley(valley, levels):
+            old_to_new = {indents: i for i, indents in enumerate(levels)}
             for segment in valley:
-                segment['indents'] = new_to_old.index(segment['indents'])
+                segment['indents'] = old_to_new[segment['indents']]
 
         indents = set()
+        levels = []  # same indents, kept sorted so max and ranks need no sort
         valley = []
         for segment in segments:
             if segment['indents'] in indents: # we've gone back up a level
-                update_valley(valley, indents)
+                update_valley(valley, levels)
                 valley = [segment]
-                if segment['indents'] != max(indents):
-                    indents.remove(max(indents))
+                if segment['indents'] != levels[-1]:
+                    indents.remove(levels.pop())
                 continue
             valley.append(segment)
             indents.add(segment['indents'])
-        update_valley(valley, indents)
+            bisect.insort(levels, segment['indents'])
+        update_valley(valley, levels)
         return segments
 
     def make_one_liners(self, segments: List) -> List:
@@ -618,7 +786,7 @@ class WhitespaceRemover(NodeTransformer):
             # combine any colon-less lines
             lines = []
             for line in segment['lines']:
-                if line.strip().endswith(':'):
+                if line.endswith(':'):  # lines are already stripped
                     lines.append(line)
                 elif lines:
                     lines[-1] += ';' + line
@@ -649,22 +817,20 @@ class WhitespaceRemover(NodeTransformer):
             if x == 6:print(x)
         """
         new_segments = []
-        i = 0
-        while i < len(segments):
-            if segments[i]['lines'][-1].strip().endswith(':') and len(segments[i+1]['lines']) == 1 and not segments[i+1]['lines'][0].endswith(':'):
-                segments[i]['lines'][-1] = segments[i]['lines'][-1] + segments[i+1]['lines'][0]
-                new_segments.append(segments[i])
-                i += 1
+        for segment in segments:
+            lines = segment['lines']
+            if new_segments and new_segments[-1]['lines'][-1].endswith(':') and len(lines) == 1 and not lines[0].endswith(':'):
+                new_segments[-1]['lines'][-1] += lines[0]
             else:
-                new_segments.append(segments[i])
-            i += 1
+                new_segments.append(segment)
         return new_segments
 
     def source_from_segments(self, segments: List) -> str:
-        return '\n'.join(
-            '\n'.join([' ' * segment['indents'] + line for line in segment['lines']])
-            for segment in segments
-        )
+        lines = []
+        for segment in segments:
+            indent = ' ' * segment['indents']
+            lines.extend(indent + line for line in segment['lines'])
+        return '\n'.join(lines)
 
     def remove_extraneous_whitespace(self, source: str) -> str:
         """Remove all unneeded whitespace.
@@ -674,30 +840,64 @@ class WhitespaceRemover(NodeTransformer):
         'def square(x):return x**2'
         >>> remover.remove_extraneous_whitespace('''try : import os''')
         'try:import os'
+        >>> print(remover.remove_extraneous_whitespace('''if x :
+        ...  return  None'''))
+        if x:
+         return None
+        >>> remover.remove_extraneous_whitespace('''print( 'lorem  ipsum' )''')
+        "print('lorem  ipsum')"
+        >>> remover.remove_extraneous_whitespace("x = '''lorem\\n  ipsum'''")
+        "x='''lorem\\n  ipsum'''"
         """
-        import tokenize
-        from io import StringIO
-        lines = []
-        for line in source.splitlines():
-            tokens = []
-            last_token = None
-            for token in tokenize.generate_tokens(StringIO(line).readline):
-                token = token.string
-                if token in keyword.kwlist and tokens and not any(last_token.endswith(c) for c in ':;= '):
-                    tokens.append(token)
-                elif tokens and (last_token not in keyword.kwlist or token in ':;='):
-                    tokens[-1] += token
-                else:
-                    tokens.append(token)
-                last_token = token
-            lines.append(' '.join(tokens))
-        return '\n'.join(lines)
+        return '\n'.join(map(self.join_tokens, self.tokens_from_source(source)))
+
+    def join_tokens(self, tokens: List[str]) -> str:
+        """Join a line's tokens, with spaces only where keywords need them.
+
+        >>> WhitespaceRemover().join_tokens([' ', 'return', 'x', '==', 'None', 'or', 'y'])
+        ' return x==None or y'
+        """
+        groups = []  # tokens to join without spaces
+        last_token, last_is_keyword = None, False
+        for token in tokens:
+            is_keyword = token in _KEYWORDS
+            if is_keyword and groups and last_token[-1] not in _SPACELESS_ENDS:
+                groups.append([token])
+            elif groups and (not last_is_keyword or token in _SEPARATORS):
+                groups[-1].append(token)
+            else:
+                groups.append([token])
+            last_token, last_is_keyword = token, is_keyword
+        return ' '.join(map(''.join, groups))
+
+    def tokens_from_source(self, source: str):
+        """Split source into lines of tokens, starting with any indentation.
+
+        The whole source is tokenized in one pass, so strings and brackets
+        can span lines.
+
+        >>> remover = WhitespaceRemover()
+        >>> list(remover.tokens_from_source('if x:\\n print(1,\\n  2)'))
+        [['if', 'x', ':'], [' ', 'print', '(', '1', ','], ['  ', '2', ')']]
+        """
+        tokens = []
+        for token in tokenize.generate_tokens(StringIO(source).readline):
+            if token.type in (tokenize.NEWLINE, tokenize.NL):
+                yield tokens
+                tokens = []
+            elif token.type not in (tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+                if not tokens and token.start[1]:  # keep the line's indentation
+                    tokens.append(token.line[:token.start[1]])
+                tokens.append(token.string)
 
 
 def minify(sources, modules='main', keep_module_names=False,
-           keep_global_variables=False, output_single_file=False,):
+           keep_global_variables=False, output_single_file=False, siblings=()):
     """Uglify source code. Simplify, minify, and obfuscate.
 
+    To minify modules separately, e.g. in parallel, pass all of their names
+    as siblings, so that imports from siblings are left alone.
+
     >>> sources, modules = uglipy(['''a = 3
     ... def square(x):
     ...     return x ** 2
@@ -724,18 +924,16 @@ def minify(sources, modules='main', keep_module_names=False,
 
         # simplify
         simplifier := ReturnSimplifier(),
-        RemoveUnusedVariables(simplifier.unused_names),
 
         # minify
-        ParentSetter(),
-        CommentRemover(),
+        remover := CommentRemover(simplifier.unused_assigns),  # also sets parents and gathers all variables across files TODO: this is naive. could compress further by actually tracking only variables in the right scope, so we can use more 1-letter vars
 
         # obfuscate
-        collector := VariableNameCollector(),  # gather all variables across files TODO: this is naive. could compress further by actually tracking only variables in the right scope, so we can use more 1-letter vars
         ind := IndependentVariableShorteners(
-            names=collector.names,
+            names=remover.names,
             modules=modules,
             keep_global_variables=keep_global_variables,
+            siblings=siblings,
         ),  # obscure within files (but not across files)
         fused := FusedVariableShortener(
             generator=ind.generator,
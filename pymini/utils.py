@@ -1,4 +1,10 @@
-from typing import List, Set
+import itertools
+import keyword
+import sys
+from typing import List, Optional, Set
+
+
+ALPHABET = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
 
 def number_to_digits(n: int, base: int = 10) -> List[int]:
@@ -19,12 +25,69 @@ def number_to_digits(n: int, base: int = 10) -> List[int]:
     while n > 0:
         digits.append(n % base)
         n //= base
-    return digits[::-1]
+    digits.reverse()
+    return digits
+
+
+def number_to_name(n: int) -> str:
+    """Convert a number to a variable name, using base 52.
+
+    For the 1st digit, a = 0. For subsequent digits, a = 1.
+
+    >>> number_to_name(0)
+    'a'
+    >>> number_to_name(51)
+    'Z'
+    >>> number_to_name(52)
+    'aa'
+    >>> number_to_name(26 * 52)  # every digit maps to a letter
+    'za'
+    """
+    letters = [ALPHABET[n % 52]]
+    n //= 52
+    while n > 0:
+        letters.append(ALPHABET[n % 52 - 1])
+        n //= 52
+    return ''.join(reversed(letters))
 
 
-def variable_name_generator(used: Set[str] = []):
+_NAMES: List[str] = []  # generated names, shared across generators
+# NOTE: not thread-safe, as a generator can't be advanced from two threads at
+# once. Pool workers are separate processes, each with its own copy.
+_PREFIXES = (number_to_name(52 * block)[:-1] for block in itertools.count())
+
+
+def nth_name(i: int) -> str:
+    """Return the i-th variable name, extending the cache 52 names at a time.
+
+    Keywords are skipped, since they can't be used as names.
+
+    >>> nth_name(0)
+    'a'
+    >>> nth_name(52)
+    'aa'
+    >>> nth_name(52 + 18)  # skips 'as'
+    'at'
+    """
+    while i >= len(_NAMES):
+        # a block of 52 names shares everything but the last letter. Intern
+        # names, like the parser does identifiers, so lookups compare by identity
+        prefix = next(_PREFIXES)
+        _NAMES.extend(
+            sys.intern(prefix + letter) for letter in ALPHABET
+            if not keyword.iskeyword(prefix + letter)
+        )
+    return _NAMES[i]
+
+
+def variable_name_generator(used: Optional[Set[str]] = None):
     """Generate variable name not currently used in scope.
+
+    NOTE: used is read once, when the first name is generated, so it can
+    still be populated after the generator is created.
     
+    >>> list(zip(variable_name_generator({'a', 'c'}), range(2)))
+    [('b', 0), ('d', 1)]
     >>> generator = variable_name_generator()
     >>> next(generator)
     'a'
@@ -39,12 +102,14 @@ def variable_name_generator(used: Set[str] = []):
     >>> next(generator)
     'aa'
     """
+    used = frozenset(used or ())
     cur = 0
+    if not used:  # nothing to skip, so skip the membership test
+        while True:
+            yield nth_name(cur)
+            cur += 1
     while True:
-        name = ''
-        for i, digit in enumerate(number_to_digits(cur, base=52)[::-1]):
-            base = 'a' if digit < 26 else 'A'
-            name = chr(ord(base) + ((digit % 26) - (i > 0))) + name  # for 1st digit, a = 0. for subsequent, a = 1
+        name = nth_name(cur)
         if name not in used:
             yield name
-        cur += 1
\ No newline at end of file
+        cur += 1
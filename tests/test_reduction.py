@@ -1,6 +1,8 @@
+from pymini.cli import main
 from pymini.pymini import minify
 from pathlib import Path
 import pytest
+import sys
 
 
 @pytest.mark.parametrize('path,size', [
@@ -9,4 +11,51 @@ import pytest
 ])
 def test_reduction(path, size):
     with open(path) as f:
-        assert len(minify(f.read(), Path(path).stem)) <= size
\ No newline at end of file
+        assert len(minify(f.read(), Path(path).stem)) <= size
+
+
+def test_without_compact_unparser(monkeypatch):
+    with open('tests/examples/pyminify.py') as f:
+        source = f.read()
+    expected = minify(source, 'pyminify')
+    monkeypatch.setattr('pymini.pymini._Unparser', None)
+    assert minify(source, 'pyminify') == expected
+
+
+def test_repeated_strings(capsys):
+    sources, _ = minify("k = 'a'\nj = 'a'\nl = 'b'\nm = 'b'\nprint(k, j, l, m)\n", 'main')
+    exec(sources[0], {})
+    assert capsys.readouterr().out == 'a a b b\n'
+
+
+def test_return_parameter(capsys):
+    sources, _ = minify("def echo(lorem):\n    return lorem\nprint(echo('ipsum'))\n", 'main')
+    exec(sources[0], {})
+    assert capsys.readouterr().out == 'ipsum\n'
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason='match is new in 3.10')
+def test_match_strings(capsys):
+    sources, _ = minify(
+        "lorem = 'k'\nmatch {'k': lorem}:\n"
+        "    case {'k': 'v'}:\n        print('v')\n"
+        "    case {'k': 'k'}:\n        print('k')\n", 'main')
+    exec(sources[0], {})
+    assert capsys.readouterr().out == 'k\n'
+
+
+def test_jobs(tmp_path, monkeypatch):
+    (tmp_path / 'main.py').write_text(
+        "import os\ndef square(number):\n    return os.sep and number ** 2\n")
+    (tmp_path / 'side.py').write_text(
+        "from main import square\ndef cube(number):\n    return square(number) * number\n")
+    outputs = []
+    for jobs in ('1', '2'):
+        output = tmp_path / f'jobs{jobs}'
+        monkeypatch.setattr(sys, 'argv', [
+            'pymini', str(tmp_path / '*.py'), '--keep-module-names',
+            '--keep-global-variables', '-j', jobs, '-o', str(output)])
+        main()
+        outputs.append({path.name: path.read_text() for path in output.iterdir()})
+    assert outputs[0] == outputs[1]
+    assert 'from main import square\n' in outputs[0]['side.py']